@@ -2,36 +2,27 @@
 # Minimal Aras BatchLoader driver (CLI-only config with no UI mixing)
 # Requires the Aras BatchLoader runtime folder; pass with --bl-dir or embed <loader_dir> in CLIBatchLoaderConfig.xml.
 
-import argparse, platform, shutil, subprocess, sys
+import argparse, functools, os, sys
 
+# subprocess, shutil and concurrent.futures are imported where they are used,
+# so --help, --init-config and --clean-failed start without loading them
+from collections.abc import Iterable, Iterator
 from pathlib import Path
 from xml_helpers import (
+    ConfigView,
     _build_cli_config_from_runtime,
-    _write_xml_pretty,
+    _prefetch_header_lines,
+    _write_bytes_atomic,
     make_delete_template,
-    read_delimiter_from_config,
-    read_first_row_from_config,
-    read_loader_dir_from_config,
 )
+# sys.platform is fixed at interpreter startup; no need to query platform.system() per call
+_IS_WINDOWS = sys.platform == "win32"
+
 # Required header name for the GUID of the Item/Relationship to delete (case-insensitive)
 REQUIRED_ID_NAME = "id"
 
-# Defaults and XML field order used when generating a clean CLI config
+# Default file name when generating a clean CLI config (field order lives in xml_helpers.CLI_CFG_ORDER)
 DEFAULT_CLI_CFG_NAME = "CLIBatchLoaderConfig.xml"
-CLI_CFG_ORDER = [
-    "server",
-    "db",
-    "user",
-    "password",
-    "max_processes",
-    "delimiter",
-    "threads",
-    "encoding",
-    "lines_per_process",
-    "first_row",
-    "log_level",
-    "log_file",
-]
 
 
 def _resolve_init_target_path(bl_config_arg: Path | None) -> Path:
@@ -45,7 +36,16 @@ def _resolve_init_target_path(bl_config_arg: Path | None) -> Path:
 #region Core Helpers
 def is_windows() -> bool:
     """Check if the platform is Windows."""
-    return platform.system().lower().startswith("win")
+    return _IS_WINDOWS
+
+@functools.lru_cache(maxsize=1)
+def _detect_wine() -> bool | None:
+    """None on Windows (no Wine needed); otherwise whether 'wine' is on PATH. The PATH walk runs once."""
+    if is_windows():
+        return None
+    import shutil
+    return shutil.which("wine") is not None
+
 
 def require(p: Path, what: str) -> None:
     """Exit if required file/dir is missing."""
@@ -53,41 +53,136 @@ def require(p: Path, what: str) -> None:
         sys.exit(f"ERROR: {what} not found: {p}")
 
 
-def find_template(data_file: Path, templates_dir: Path | None = None) -> Path | None:
-    """Return the template for a data file: prefer <templates_dir>/<stem>.xml,
-    else <data_dir>/<stem>_Template.xml."""
-    name = data_file.stem
-    candidates: list[Path] = []
+def _scan_by_suffix(dirpath: Path, suffix: str) -> list[os.DirEntry]:
+    """Return directory entries in dirpath ending with suffix, sorted case-insensitively by name.
+
+    Uses os.scandir so names and file types come from the directory read itself
+    (no per-entry stat). Suffix matching follows the platform's case rules, like glob,
+    and a missing directory (or a path that is not a directory) yields no entries.
+    """
+    try:
+        with os.scandir(dirpath) as it:
+            entries = [e for e in it if os.path.normcase(e.name).endswith(suffix) and e.is_file()]
+    except (FileNotFoundError, NotADirectoryError):
+        return []
+    # Lowercased name first, then the path as a deterministic tie-break for names differing only in case
+    entries.sort(key=lambda e: (e.name.lower(), e.path))
+    return entries
+
+
+def _list_by_suffix(dirpath: Path, suffix: str) -> list[Path]:
+    """Return files in dirpath ending with suffix as Paths, in _scan_by_suffix order."""
+    return [Path(e.path) for e in _scan_by_suffix(dirpath, suffix)]
+
+
+def build_template_index(templates_dir: Path | None, *data_dirs: Path) -> dict[str, Path]:
+    """Map normcased data-file stem -> template, scanning each directory once.
 
-    # Search order matters: central templates dir or within data directory
+    Entries are added in search order and the first match wins: <templates_dir>/<stem>.xml,
+    then <data_dir>/<stem>_Template.xml for each data_dir in turn. Missing directories are skipped.
+    """
+    index: dict[str, Path] = {}
     if templates_dir is not None:
-        candidates.append(templates_dir / f"{name}.xml")
-    candidates.append(data_file.with_name(f"{name}_Template.xml"))
+        for e in _scan_by_suffix(templates_dir, ".xml"):
+            index.setdefault(os.path.normcase(e.name[:-4]), Path(e.path))
+    suffix = os.path.normcase("_Template.xml")
+    for d in data_dirs:
+        for e in _scan_by_suffix(d, suffix):
+            index.setdefault(os.path.normcase(e.name[: -len(suffix)]), Path(e.path))
+    return index
 
-    # Ensure that the candidate template file exists
-    for c in candidates:
-        if c.exists():
-            return c
-    return None
 
+def find_template(data_file: Path, template_index: dict[str, Path]) -> Path | None:
+    """Return the template for a data file from an index built by build_template_index."""
+    return template_index.get(os.path.normcase(data_file.stem))
+
+
+def _abs(p: Path) -> str:
+    """Absolute path string; already-absolute paths are used as-is (is_absolute() needs no syscall)."""
+    return os.fspath(p) if p.is_absolute() else os.fspath(p.resolve())
+
+
+def exe_prefix(exe: Path, use_wine: bool) -> tuple[str, ...]:
+    """Absolute command prefix for BatchLoaderCmd.exe, built once per run."""
+    exe_s = _abs(exe)
+    # Prefix command with 'wine' on non-Windows hosts so the EXE can run
+    return ("wine", exe_s) if use_wine else (exe_s,)
 
 
 def build_cmd(
-    exe: Path,
-    bl_cfg: Path,
+    prefix: tuple[str, ...],
+    bl_cfg: str,
     data: Path,
     template: Path,
     log: Path,
-    use_wine: bool,
 ) -> list[str]:
-    """Build the BatchLoaderCmd.exe invocation."""
-    data = data.resolve()
-    template = template.resolve()
-    log = log.resolve()
-    bl_cfg = bl_cfg.resolve()
-    # Prefix command with 'wine' on non-Windows hosts so the EXE can run
-    cmd = ["wine", str(exe)] if use_wine else [str(exe)] 
-    return cmd + ["-d", str(data), "-c", str(bl_cfg), "-t", str(template), "-l", str(log)]
+    """Build the BatchLoaderCmd.exe invocation.
+
+    prefix (see exe_prefix) and bl_cfg are invariant across a run, so callers
+    build them once; only the per-file paths are made absolute here.
+    """
+    return [
+        *prefix,
+        "-d", _abs(data),
+        "-c", bl_cfg,
+        "-t", _abs(template),
+        "-l", _abs(log),
+    ]
+
+
+def _run_one(task: tuple[str, list[str], Path], cwd: str) -> tuple[str, int, Path]:
+    """Run one (name, cmd, log) task with its console output in <log>.out; returns (name, rc, log)."""
+    import subprocess
+    name, cmd, log = task
+    # BatchLoaderCmd.exe still writes its own -l log; this only captures stdout/stderr
+    with open(log.with_suffix(".out"), "wb") as out:
+        rc = subprocess.run(cmd, cwd=cwd, stdin=subprocess.DEVNULL, stdout=out, stderr=subprocess.STDOUT).returncode
+    return name, rc, log
+
+
+def run_tasks(tasks: Iterable[tuple[str, list[str], Path] | str], label: str, runtime_dir: Path, jobs: int = 1) -> None:
+    """Run each (name, cmd, log) task, one at a time or with up to `jobs` runs in flight.
+
+    A plain string in `tasks` is a message (e.g. a [SKIP] line) printed in sequence.
+    """
+    import subprocess
+    # Run from runtime_dir so BatchLoaderCmd.exe can resolve its DLLs
+    cwd = os.fspath(runtime_dir)
+    if jobs <= 1:
+        it = iter(tasks)
+        item = next(it, None)
+        while item is not None:
+            if isinstance(item, str):
+                print(item)
+                item = next(it, None)
+                continue
+            name, cmd, log = item
+            # Flush before launching so the progress line precedes the child's own output
+            sys.stdout.write(f"[{label}] {name}\n")
+            sys.stdout.flush()
+            # No stdin, so an unattended run can never block on a console prompt
+            with subprocess.Popen(cmd, cwd=cwd, stdin=subprocess.DEVNULL) as proc:
+                # Prepare the next task (template lookup / delete template) while this one runs
+                item = next(it, None)
+                rc = proc.wait()
+            if rc != 0:
+                print(f"  -> non-zero exit ({rc}); check {log}")
+        return
+
+    # Console output of concurrent runs would interleave, so each run's goes to <log>.out
+    from concurrent.futures import ThreadPoolExecutor, as_completed
+    with ThreadPoolExecutor(max_workers=jobs) as pool:
+        futures = []
+        for item in tasks:
+            if isinstance(item, str):
+                print(item)
+                continue
+            futures.append(pool.submit(_run_one, item, cwd))
+        for fut in as_completed(futures):
+            name, rc, log = fut.result()
+            print(f"[{label}] {name}")
+            if rc != 0:
+                print(f"  -> non-zero exit ({rc}); check {log}")
 #endregion
 
 
@@ -122,6 +217,15 @@ def parse_args() -> argparse.Namespace:
         help="Directory containing XML templates; fallback is next to each data file.",
     )
     ap.add_argument("--logs-dir", type=Path, default=Path("./logs"))
+    ap.add_argument(
+        "--jobs",
+        type=int,
+        default=1,
+        help=(
+            "Number of BatchLoaderCmd.exe runs to keep in flight (default: 1). "
+            "Values above 1 ignore load order; --delete always runs serially."
+        ),
+    )
 
     ap.add_argument(
         "--retry",
@@ -172,14 +276,17 @@ def handle_clean_failed(args: argparse.Namespace) -> bool:
     # Handle --clean-failed flag
     if not args.clean_failed: 
         return False
-    failed_files = list(args.data_dir.glob("*.failed"))
+    # Work on the scandir entries directly; no Path objects are needed just to delete
+    failed_files = _scan_by_suffix(args.data_dir, ".failed")
     if not failed_files:
         print(f"No .failed files found in {args.data_dir}")
     else:
-        print(f"Found {len(failed_files)} .failed file(s) to remove:")
-        for f in failed_files:
-            print(f"  - {f.name}")
-            f.unlink() # Remove the failed file
+        # One write for the whole listing instead of a print per file
+        lines = [f"Found {len(failed_files)} .failed file(s) to remove:"]
+        lines.extend(f"  - {e.name}" for e in failed_files)
+        sys.stdout.write("\n".join(lines) + "\n")
+        for e in failed_files:
+            os.unlink(e.path) # Remove the failed file
         print(f"\nRemoved {len(failed_files)} .failed file(s).")
     return True
 
@@ -189,7 +296,7 @@ def resolve_cli_cfg(args: argparse.Namespace) -> Path:
     if args.bl_config is not None:
         return args.bl_config
     else:
-        return Path("./CLIBatchLoaderConfig.xml")
+        return Path(f"./{DEFAULT_CLI_CFG_NAME}")
 
 def run_init_config_if_requested(args: argparse.Namespace, cli_cfg: Path) -> bool:
     """Initialize a clean CLI config from the runtime config when requested."""
@@ -207,8 +314,8 @@ def run_init_config_if_requested(args: argparse.Namespace, cli_cfg: Path) -> boo
     require(runtime_cfg, "Runtime BatchLoaderConfig.xml")
 
     try:
-        new_root = _build_cli_config_from_runtime(runtime_cfg, args.bl_dir)
-        _write_xml_pretty(new_root, target, indent_char="\t")
+        rendered = _build_cli_config_from_runtime(runtime_cfg, args.bl_dir)
+        _write_bytes_atomic(target, rendered.encode("utf-8"))
     except Exception as e:
         sys.exit(f"ERROR: failed to initialize CLI config: {e}")
 
@@ -216,11 +323,12 @@ def run_init_config_if_requested(args: argparse.Namespace, cli_cfg: Path) -> boo
     return True
 
 
-def setup_runtime_env(args: argparse.Namespace, cli_cfg: Path) -> tuple[Path, Path, bool]:
+def setup_runtime_env(
+    args: argparse.Namespace,
+    cfg: ConfigView,
+) -> tuple[Path, Path, bool]:
     """Validate paths and setup directories"""
-    require(cli_cfg, "CLI config XML (e.g., CLIBatchLoaderConfig.xml)")
-    
-    runtime_dir = args.bl_dir or read_loader_dir_from_config(cli_cfg)
+    runtime_dir = args.bl_dir or cfg.loader_dir
     if not runtime_dir:
         sys.exit("ERROR: No runtime provided. Set --bl-dir or <loader_dir> in your CLI config")
     exe = runtime_dir / "BatchLoaderCmd.exe"
@@ -233,12 +341,10 @@ def setup_runtime_env(args: argparse.Namespace, cli_cfg: Path) -> tuple[Path, Pa
     args.logs_dir.mkdir(parents=True, exist_ok=True)
 
     # Check if we need Wine for non-Windows systems
-    use_wine = False
-    if not is_windows():
-        if shutil.which("wine"):
-            use_wine = True
-        else:
-            sys.exit("ERROR: Windows EXE detected and no 'wine' found. Run on Windows/WSL or install wine.")
+    wine = _detect_wine()
+    if wine is False:
+        sys.exit("ERROR: Windows EXE detected and no 'wine' found. Run on Windows/WSL or install wine.")
+    use_wine = bool(wine)
 
     return exe, runtime_dir, use_wine
 
@@ -256,44 +362,40 @@ def run_retry_mode(args: argparse.Namespace, exe: Path, cli_cfg: Path, runtime_d
     failed_root = args.retry_dir or args.data_dir
     if not failed_root.exists():
         sys.exit(f"ERROR: retry dir not found: {failed_root}")
-    failed_files = sorted(failed_root.glob("*.failed"), key=lambda p: p.name.lower())
+    failed_files = _list_by_suffix(failed_root, ".failed")
     if not failed_files:
         sys.exit(f"ERROR: --retry specified but no *.failed files found in {failed_root}")
 
     retry_logs_dir = args.logs_dir / "retry"
     retry_logs_dir.mkdir(parents=True, exist_ok=True)
+    # Resolve invariant paths once rather than per file
+    prefix = exe_prefix(exe, use_wine)
+    cfg_s = _abs(cli_cfg)
 
     print(f"Retrying {len(failed_files)} file(s) from: {failed_root.resolve()}\n")
-    for data in failed_files:
-        # '001-User.failed' -> stem '001-User'; we re-use the original template name
-        name = data.stem
-        # Retry uses the same template selection logic as normal mode
-        # Try templates_dir/<name>.xml, else fallback to data/<name>_Template.xml
-        template = find_template(data, args.templates_dir)
-        if not template:
-            candidate = args.data_dir / f"{name}_Template.xml" # Fallback to data/<name>_Template.xml
-            if candidate.exists():
-                template = candidate
-        if not template:
-            print(f"[SKIP] {name}: missing template (Templates/{name}.xml or {name}_Template.xml)") 
-            continue
-
-        log = retry_logs_dir / f"{name}.retry.log"
-        print(f"[RETRY] {name}")
-
-        # Run from runtime_dir so BatchLoaderCmd.exe can resolve its DLLs
-        rc = subprocess.run(
-            build_cmd(exe, cli_cfg, data, template, log, use_wine),
-            cwd=str(runtime_dir),
-        ).returncode
-        if rc != 0:
-            print(f"  -> non-zero exit ({rc}); check {log}")
+    # Templates next to the .failed files, then next to the original data files
+    template_index = build_template_index(args.templates_dir, failed_root, args.data_dir)
+    def tasks() -> Iterator[tuple[str, list[str], Path] | str]:
+        for data in failed_files:
+            # '001-User.failed' -> stem '001-User'; we re-use the original template name
+            name = data.stem
+            # Retry uses the same template selection logic as normal mode
+            # Try templates_dir/<name>.xml, else fallback to data/<name>_Template.xml
+            template = find_template(data, template_index)
+            if not template:
+                yield f"[SKIP] {name}: missing template (Templates/{name}.xml or {name}_Template.xml)"
+                continue
+
+            log = retry_logs_dir / f"{name}.retry.log"
+            yield name, build_cmd(prefix, cfg_s, data, template, log), log
+
+    run_tasks(tasks(), "RETRY", runtime_dir, args.jobs)
     print("\nDone.")
 
 
 def collect_data_files(args: argparse.Namespace) -> list[Path]:
     """Collect all *.txt files in the data directory"""
-    data_files = sorted(args.data_dir.glob("*.txt"), key=lambda p: p.name.lower())
+    data_files = _list_by_suffix(args.data_dir, ".txt")
     if not data_files:
         sys.exit(f"ERROR: No *.txt files found in {args.data_dir}")
     if args.delete:
@@ -312,48 +414,63 @@ def process_normal_mode(
     delimiter: str | None,
 ) -> None:
     data_files = collect_data_files(args)
-
-    # Process each data file
-    for data in data_files:
-        name = data.stem
-
-        # Resolve the "add" template as the source
-        add_tpl = find_template(data, args.templates_dir)
-        if not add_tpl:
-            missing_hint = f"Templates/{name}.xml or {name}_Template.xml"
-            print(f"[SKIP] {name}: missing template ({missing_hint})")
-            continue
-
-        # If deleting, transform to a delete template on the fly
-        template = add_tpl
-        logs_dir = args.logs_dir
-        if args.delete:
-            try:
-                template = make_delete_template(
-                    add_tpl,
-                    args.delete_templates_dir,
-                    data_file=data,
-                    first_row=first_row,
-                    delimiter=delimiter,
-                )
-            except Exception as e:
-                print(f"[SKIP] {name}: could not build delete template: {e}")
+    # Resolve invariant paths once rather than per file
+    prefix = exe_prefix(exe, use_wine)
+    cfg_s = _abs(cli_cfg)
+
+    # Bind loop-invariant options to locals once
+    delete = args.delete
+    template_index = build_template_index(args.templates_dir, args.data_dir)
+    delete_templates_dir = args.delete_templates_dir
+
+    # Create output directories once, not per file
+    logs_dir = args.logs_dir
+    if delete:
+        logs_dir = args.logs_dir / "delete"
+        logs_dir.mkdir(parents=True, exist_ok=True)
+        delete_templates_dir.mkdir(parents=True, exist_ok=True)
+    # With a header row, read every data file's header up front in parallel
+    headerless = (first_row or 1) <= 1
+    header_lines = _prefetch_header_lines(data_files) if delete and not headerless else {}
+
+    # Resolve templates lazily so each file's template is prepared while the previous file runs
+    def tasks() -> Iterator[tuple[str, list[str], Path] | str]:
+        for data in data_files:
+            name = data.stem
+
+            # Resolve the "add" template as the source
+            add_tpl = find_template(data, template_index)
+            if not add_tpl:
+                missing_hint = f"Templates/{name}.xml or {name}_Template.xml"
+                yield f"[SKIP] {name}: missing template ({missing_hint})"
                 continue
-            logs_dir = args.logs_dir / "delete"
-            logs_dir.mkdir(parents=True, exist_ok=True)
-
-        
 
-        log = logs_dir / f"{name}.log"
-        print(f"[{'DELETE' if args.delete else 'LOAD'}] {name}")
-
-        # Run from runtime_dir so BatchLoaderCmd.exe can resolve its DLLs
-        rc = subprocess.run(
-            build_cmd(exe, cli_cfg, data, template, log, use_wine),
-            cwd=str(runtime_dir),
-        ).returncode
-        if rc != 0:
-            print(f"  -> non-zero exit ({rc}); check {log}")
+            # If deleting, transform to a delete template on the fly
+            template = add_tpl
+            if delete:
+                if headerless:
+                    # Yielded, not printed, so it lands after the previous file's output
+                    yield (f"[WARN] No headers expected (<first_row>={first_row or 1}); "
+                           f"assuming column 1 is the GUID in {data.name}")
+                try:
+                    template = make_delete_template(
+                        add_tpl,
+                        delete_templates_dir,
+                        data_file=data,
+                        first_row=first_row,
+                        delimiter=delimiter,
+                        header_line=header_lines.get(data),
+                    )
+                except Exception as e:
+                    yield f"[SKIP] {name}: could not build delete template: {e}"
+                    continue
+
+            log = logs_dir / f"{name}.log"
+            yield name, build_cmd(prefix, cfg_s, data, template, log), log
+
+    # Deletes must stay in reverse order (relationships before items), so never run them concurrently
+    jobs = 1 if delete else args.jobs
+    run_tasks(tasks(), "DELETE" if delete else "LOAD", runtime_dir, jobs)
 
     print("\nDone.")
 
@@ -361,6 +478,8 @@ def process_normal_mode(
 def main() -> None:
     """CLI entrypoint."""
     args = parse_args()
+    if args.jobs < 1:
+        sys.exit("ERROR: --jobs must be at least 1")
     
     # Handle --clean-failed flag
     if handle_clean_failed(args):
@@ -373,11 +492,15 @@ def main() -> None:
     if run_init_config_if_requested(args, cli_cfg):
         return
 
-    exe, runtime_dir, use_wine = setup_runtime_env(args, cli_cfg)
-    # Read first_row from CLI config to determine header presence for delete-template generation
-    first_row = read_first_row_from_config(cli_cfg)
-    # Read delimiter from CLI config for header parsing in delete mode
-    delimiter = read_delimiter_from_config(cli_cfg)
+    require(cli_cfg, "CLI config XML (e.g., CLIBatchLoaderConfig.xml)")
+    # Parse the CLI config once for loader_dir, first_row and delimiter
+    cfg = ConfigView.from_path(cli_cfg)
+
+    exe, runtime_dir, use_wine = setup_runtime_env(args, cfg)
+    # first_row determines header presence for delete-template generation
+    first_row = cfg.first_row
+    # delimiter is used for header parsing in delete mode
+    delimiter = cfg.delimiter
 
     # Header
     print_header(exe, cli_cfg, args)
@@ -1,5 +1,15 @@
+import functools, io, os
+
+from html import escape
 from pathlib import Path
-import xml.etree.ElementTree as ET
+
+# Prefer libxml2-backed lxml when installed; it covers the ElementTree API used here.
+try:
+    from lxml import etree as ET
+    _HAVE_LXML = True
+except ImportError:
+    import xml.etree.ElementTree as ET
+    _HAVE_LXML = False
 
 CLI_CFG_ORDER = [
     "server",
@@ -16,92 +26,109 @@ CLI_CFG_ORDER = [
     "log_file",
 ]
 
-def _xml_indent(elem: ET.Element, level: int = 0, indent_char: str = "\t") -> None:
-    """Pretty print: add newlines and indentation in-place (tabs by default)."""
-    i = "\n" + (indent_char * level)
-    if len(elem): 
-        if not elem.text or not elem.text.strip(): # If the element has no text or the text is empty, add the indentation
-            elem.text = i + indent_char
-        for child in elem: # For each child of the element, add the indentation
-            _xml_indent(child, level + 1, indent_char)
-            if not child.tail or not child.tail.strip(): # If the child has no tail or the tail is empty, add the indentation
-                child.tail = i + indent_char
-        if not elem[-1].tail or not elem[-1].tail.strip(): # If the last child of the element has no tail or the tail is empty, add the indentation
-            elem[-1].tail = i
-    else:
-        if not elem.text: # If the element has no text, add an empty string
-            elem.text = ""
-        if level and (not elem.tail or not elem.tail.strip()): # If the element has no tail or the tail is empty, add the indentation
-            elem.tail = i
+def _write_bytes_atomic(target: Path, data: bytes) -> None:
+    """Write data next to target and rename it into place (atomic on POSIX and Windows).
 
+    Each call writes its own uniquely named temp file (created by mkstemp, so
+    owner-only permissions), so concurrent runs writing the same target never
+    share or truncate each other's temp file.
+    """
+    import tempfile  # only needed when writing; keeps startup imports light
 
-def _write_xml_pretty(root: ET.Element, target: Path, indent_char: str = "\t") -> None:
-    """Write XML to target with pretty indentation and a trailing newline."""
     # Ensure parent directory exists
     if not target.parent.exists():
         target.parent.mkdir(parents=True, exist_ok=True)
 
-    _xml_indent(root, level=0, indent_char=indent_char) 
-    ET.ElementTree(root).write(target, encoding="utf-8", xml_declaration=True, short_empty_elements=False)
-
-    # Ensure trailing newline at EOF
+    fd, tmp = tempfile.mkstemp(dir=target.parent, prefix=target.name, suffix=".tmp")
     try:
-        with target.open("ab") as f:  # Open file in append binary mode
-            f.seek(0, 2)  # Seek to end of file
-            f.write(b"\n")
-    except Exception:
-        pass
+        with os.fdopen(fd, "wb") as f:
+            f.write(data)
+        os.replace(tmp, target)
+    except BaseException:
+        try:
+            os.unlink(tmp)
+        except FileNotFoundError:
+            pass
+        raise
 
 
-def _pick_first_text(root: ET.Element, tag: str) -> str:
-    """First non-empty text for a tag. Then first. Then the empty string."""
-    elems = root.findall(f"./{tag}")
-    if not elems: 
-        return "" 
-    for el in elems: # For each element, get the text and strip whitespace
-        txt = (el.text or "").strip()
-        if txt: # If the text is not empty, return it
-            return txt
-    return (elems[0].text or "").strip() # If no non-empty text is found, return the first element's text and strip whitespace
+def _write_xml_pretty(root: ET.Element, target: Path, indent_char: str = "\t") -> None:
+    """Write XML to target with pretty indentation and a trailing newline.
+
+    The document is serialized in memory and written with _write_bytes_atomic,
+    so readers never see a partially written config or template.
+    """
+    ET.indent(root, space=indent_char)
+    buf = io.BytesIO()
+    if _HAVE_LXML:
+        # lxml writes <tag></tag> for empty-string text, which the builders here set
+        ET.ElementTree(root).write(buf, encoding="utf-8", xml_declaration=True)
+    else:
+        ET.ElementTree(root).write(buf, encoding="utf-8", xml_declaration=True, short_empty_elements=False)
+    buf.write(b"\n")  # Trailing newline at EOF
+    _write_bytes_atomic(target, buf.getvalue())
 
 
-def _build_cli_config_from_runtime(runtime_cfg: Path, loader_dir: Path) -> ET.Element:
-    """Create a new minimal CLI config element from the runtime config and loader_dir."""
+def _build_cli_config_from_runtime(runtime_cfg: Path, loader_dir: Path) -> str:
+    """Render a new minimal CLI config (tab-indented XML text) from the runtime config and loader_dir.
+
+    The output schema is fixed (CLI_CFG_ORDER plus <loader_dir>), so it is
+    emitted directly as text instead of building and pretty-printing a tree.
+    """
     src_tree = ET.parse(str(runtime_cfg)) 
     src_root = src_tree.getroot() 
 
-    new_root = ET.Element("BatchLoaderConfig") # Root for new CLI config
+    # One pass over the root's children: keep the first non-empty text per wanted tag,
+    # else the first (empty) one
+    wanted = set(CLI_CFG_ORDER)
+    found: dict[str, str] = {}
+    for child in src_root:
+        tag = child.tag
+        if tag in wanted:
+            txt = (child.text or "").strip()
+            if tag not in found or (not found[tag] and txt):
+                found[tag] = txt
+
+    lines = ["<?xml version='1.0' encoding='utf-8'?>", "<BatchLoaderConfig>"]
     for tag in CLI_CFG_ORDER:
-        ET.SubElement(new_root, tag).text = _pick_first_text(src_root, tag)
+        lines.append(f"\t<{tag}>{escape(found.get(tag, ''), quote=False)}</{tag}>")
+    lines.append(f"\t<loader_dir>{escape(str(loader_dir), quote=False)}</loader_dir>")
+    lines.append("</BatchLoaderConfig>")
+    return "\n".join(lines) + "\n"
 
-    new_root.append(ET.Comment(
-        " Runtime folder used by the CLI script (absolute or relative to this file) "
-    ))
-    ET.SubElement(new_root, "loader_dir").text = str(loader_dir)
 
-    return new_root
+@functools.lru_cache(maxsize=4)
+def _parse_cfg_values(cfg_path: str, mtime_ns: int) -> dict[str, str | None]:
+    """Map each top-level config tag to its raw text (first occurrence wins) in one pass.
 
+    mtime_ns is only part of the cache key. Elements are cleared as they close,
+    so no tree is kept. The whole file is always read, so a config that is
+    malformed anywhere raises ET.ParseError. Callers must not mutate the returned dict.
+    """
+    values: dict[str, str | None] = {}
+    depth = 0
+    for event, elem in ET.iterparse(cfg_path, events=("start", "end")):
+        if event == "start":
+            depth += 1
+            continue
+        depth -= 1
+        if depth == 1:
+            values.setdefault(elem.tag, elem.text)
+            elem.clear()
+    return values
 
-def read_loader_dir_from_config(cfg_path: Path) -> Path | None:
-    """Return absolute <loader_dir> from config, resolving relative paths against the config file."""
-    try:
-        tree = ET.parse(str(cfg_path)) 
-        root = tree.getroot() 
-        elem = root.find("./loader_dir") 
-        if elem is None:
-            return None
-        value = (elem.text or "").strip()
-        if not value:
-            return None
-        p = Path(value)
-        if not p.is_absolute():
-            # Resolve relative loader_dir against the config file's folder.
-            p = (cfg_path.parent / p).resolve()
-        return p
-    except ET.ParseError:
-        return None            
 
+def _load_cfg_values(cfg_path: Path) -> dict[str, str | None]:
+    """Return the cached top-level values of a config file, re-parsing only if the file changed."""
+    resolved = cfg_path.resolve()
+    return _parse_cfg_values(str(resolved), os.stat(resolved).st_mtime_ns)
 
+
+# Known <delimiter> spellings (lowercased) -> delimiter character
+_DELIM_MAP = {"\\t": "\t", "tab": "\t", ",": ",", "comma": ",", "|": "|", "pipe": "|"}
+
+
+@functools.lru_cache(maxsize=32)
 def _normalize_delimiter_text(raw: str | None) -> str | None:
     """Normalize <delimiter> text to a single-char delimiter. Supports "\t", tab, comma, pipe."""
     if raw is None:
@@ -111,62 +138,145 @@ def _normalize_delimiter_text(raw: str | None) -> str | None:
     val = raw.strip()
     if not val:
         return "\t"
-    lower = val.lower()
-    if lower in {"\\t", "tab"}:
-        return "\t"
-    if lower in {",", "comma"}:
-        return ","
-    if lower in {"|", "pipe"}:
-        return "|"
-    if len(val) == 1:
-        return val
-    return "\t"
+    return _DELIM_MAP.get(val.lower(), val if len(val) == 1 else "\t")
+
+
+class ConfigView:
+    """
+    Values of a CLI config, read in one parse:
+
+      - loader_dir: absolute Path (relative values resolve against the config file's folder), or None
+      - delimiter: normalized single character, or None
+      - first_row: int, or None if missing/invalid
+      - raw: top-level tag -> raw text, for fields without a dedicated attribute
+
+    A malformed config yields None for every field.
+    """
+
+    __slots__ = ("loader_dir", "delimiter", "first_row", "raw")
+
+    def __init__(
+        self,
+        loader_dir: Path | None,
+        delimiter: str | None,
+        first_row: int | None,
+        raw: dict[str, str | None],
+    ) -> None:
+        self.loader_dir = loader_dir
+        self.delimiter = delimiter
+        self.first_row = first_row
+        self.raw = raw
+
+    @classmethod
+    def from_path(cls, cfg_path: Path) -> "ConfigView":
+        try:
+            raw = _load_cfg_values(cfg_path)
+        except ET.ParseError:
+            raw = {}
+
+        loader_dir = None
+        value = (raw.get("loader_dir") or "").strip()
+        if value:
+            loader_dir = Path(value)
+            if not loader_dir.is_absolute():
+                # Resolve relative loader_dir against the config file's folder.
+                loader_dir = (cfg_path.parent / loader_dir).resolve()
+
+        first_row = None
+        value = (raw.get("first_row") or "").strip()
+        if value:
+            try:
+                first_row = int(value)
+            except ValueError:
+                pass
+
+        return cls(loader_dir, _normalize_delimiter_text(raw.get("delimiter")), first_row, raw)
+
+
+def read_loader_dir_from_config(cfg_path: Path) -> Path | None:
+    """Return absolute <loader_dir> from config, resolving relative paths against the config file."""
+    return ConfigView.from_path(cfg_path).loader_dir
 
 
 def read_delimiter_from_config(cfg_path: Path) -> str | None:
     """Read <delimiter> from XML config and normalize to a single character."""
-    try:
-        tree = ET.parse(str(cfg_path))
-        root = tree.getroot()
-        elem = root.find("./delimiter")
-        if elem is None:
-            return None
-        return _normalize_delimiter_text(elem.text)
-    except ET.ParseError:
-        return None
+    return ConfigView.from_path(cfg_path).delimiter
 
 
 def read_first_row_from_config(cfg_path: Path) -> int | None:
     """Read <first_row> as int; return None if missing/invalid."""
-    try:
-        tree = ET.parse(str(cfg_path))
-        root = tree.getroot()
-        elem = root.find("./first_row")
-        if elem is None:
-            return None
-        value = (elem.text or "").strip()
-        if not value:
-            return None
+    return ConfigView.from_path(cfg_path).first_row
+
+
+def _read_header_line(data_file: Path) -> bytes:
+    """Return the first line of a data file as raw bytes (line ending removed).
+
+    Reads in binary mode only as far as the first newline, so headers wider than
+    one buffer are still read whole; nothing is decoded.
+    """
+    with data_file.open("rb") as f:
+        line = f.readline()
+    return line.rstrip(b"\r\n")
+
+
+def _prefetch_header_lines(files: list[Path], max_workers: int = 8) -> dict[Path, bytes]:
+    """Read the first line of each file concurrently; unreadable files are left out.
+
+    Overlaps the open/read latency of many data files (e.g. on a network share).
+    Callers fall back to reading a missing entry themselves, which reports the error.
+    """
+    def read(p: Path) -> bytes | None:
         try:
-            return int(value)
-        except ValueError:
+            return _read_header_line(p)
+        except OSError:
             return None
-    except ET.ParseError:
-        return None
 
+    from concurrent.futures import ThreadPoolExecutor  # only delete mode needs it
+    with ThreadPoolExecutor(max_workers=max_workers) as pool:
+        return {p: line for p, line in zip(files, pool.map(read, files)) if line is not None}
 
-def _read_headers_for(data_file: Path, delimiter: str | None = None) -> list[str]:
+
+def _find_id_col_streaming(
+    data_file: Path,
+    delimiter: str | None = None,
+    header_line: bytes | None = None,
+) -> int | None:
     """
-    Read the first (header) line from a delimited data file and return a list of header names.
-    Returns [] if the file cannot be read.
+    Return the 1-based index of the 'id' header column (case-insensitive), or None.
+
+    Scans the raw header bytes and stops at the first match, without decoding
+    the line or building a header list. Empty header fields are not counted,
+    matching _read_headers_for. header_line, if given, is used instead of reading
+    the file (see _prefetch_header_lines). Raises OSError if the file cannot be read.
 
     Note: This helper is only used when the CLI config indicates headers
     (i.e., <first_row> > 1). For headerless files (<first_row> <= 1) we never
     call this; deletes bind id to column 1 without inspecting headers.
     """
+    sep = (delimiter or "\t").encode("utf-8")  # Determine delimiter (default to tab)
+    if header_line is None:
+        header_line = _read_header_line(data_file)
+    idx = 0
+    for field in header_line.split(sep):
+        field = field.strip()
+        if not field:
+            continue
+        idx += 1
+        if field.lower() == b"id":
+            return idx
+    return None
+
+
+def _read_headers_for(data_file: Path, delimiter: str | None = None) -> list[str]:
+    """
+    Read the first (header) line from a delimited data file and return a list of header names.
+    Returns [] if the file cannot be read.
+
+    Nothing in this package calls it any more (delete mode uses _find_id_col_streaming);
+    it is kept for scripts that import it.
+    """
     try:
-        with data_file.open("r", encoding="utf-8") as f:
-            first_line = f.readline().strip("\r\n")  # Read first line and remove line endings
+        first_line = _read_header_line(data_file).decode("utf-8")
         # Determine delimiter (default to tab)
         sep = delimiter or "\t"
         # Split by configured delimiter to get raw header columns
@@ -179,13 +289,43 @@ def _read_headers_for(data_file: Path, delimiter: str | None = None) -> list[str
         return []  # Return empty list if file can't be read
 
 
-def _find_id_col(headers: list[str]) -> int | None:
-    """Return 1-based index of the required 'id' column (case-insensitive)."""
-    lower_headers = [h.lower() for h in headers]
-    for idx, header in enumerate(lower_headers):
-        if header == "id":
-            return idx + 1
-    return None
+def _delete_id_expr(
+    data_file: Path | None,
+    first_row: int | None,
+    delimiter: str | None,
+    header_line: bytes | None = None,
+) -> str:
+    """Return the id binding ("@<column>") for a delete template.
+
+    Callers report the headerless assumption (column 1 is the GUID) themselves,
+    so the [WARN] line stays in order with their other output.
+    """
+    # Decide header presence strictly from config:
+    #   first_row > 1  ⇒ a header row exists in the data file
+    #   first_row <= 1 ⇒ headerless data (we do not inspect the file)
+    header_expected = (first_row or 1) > 1
+    if not header_expected:
+        # Headerless mode: GUID must be in column 1 for all types (base/relationship)
+        return "@1"
+
+    # Headers are expected in this branch. We need to read them to locate the GUID column
+    if not data_file:
+        raise RuntimeError(
+            "Delete-template generation expects a data file when <first_row> indicates "
+            "a header row (> 1) so the GUID column can be discovered via the 'id' header."
+        )
+    try:
+        id_idx = _find_id_col_streaming(data_file, delimiter, header_line)
+    except OSError as e:
+        raise RuntimeError(
+            f"Could not read header row from '{data_file.name}': {e}. "
+            "Verify <first_row> in your CLI config and the file encoding."
+        ) from e
+    if id_idx is None:
+        raise RuntimeError(
+            f"'{data_file.name}' must include an 'id' column containing the GUID for the item/relationship to delete."
+        )
+    return f"@{id_idx}"
 
 
 def make_delete_template(
@@ -194,6 +334,7 @@ def make_delete_template(
     data_file: Path | None = None,
     first_row: int | None = None,
     delimiter: str | None = None,
+    header_line: bytes | None = None,
 ) -> Path:
     """
     Create a 'delete' variant of an existing add-template (ID-only deletes).
@@ -203,60 +344,70 @@ def make_delete_template(
         We bind the delete key as id="@1" (column 1 is assumed to be the GUID).
       - If <first_row> > 1 (headers present), we read the header row from
         the data file and locate the GUID column by the required 'id' header.
-        We then bind id="@<index>".
+        We then bind id="@<index>". A header_line already read by the caller
+        (see _prefetch_header_lines) is used instead of re-opening the file.
+
+    A template generated by an earlier run is reused as-is when its stamp file
+    (<name>.mtime) shows the same add-template, modification time, and id binding.
 
     This function never deletes by business keys (e.g., item_number). Deletes
     are always by GUID, either base Item id or relationship id.
+
+    Callers create dest_dir once up front; it is not re-created per template.
     """
-    dest_dir.mkdir(parents=True, exist_ok=True)
-    tree = ET.parse(str(add_template))
-    root = tree.getroot()
+    out_path = dest_dir / add_template.name
+    id_expr = _delete_id_expr(data_file, first_row, delimiter, header_line)
+
+    # The delete template depends only on the add-template and the id binding
+    src = add_template.resolve()
+    stamp_path = out_path.with_name(out_path.name + ".mtime")
+    stamp = f"{src}\n{add_template.stat().st_mtime_ns}\n{id_expr}\n"
+    try:
+        if out_path.exists() and stamp_path.read_text(encoding="utf-8") == stamp:
+            return out_path
+    except OSError:
+        pass  # No usable stamp; rebuild
+
+    # Stream the template instead of building the full DOM. The first <Item>'s
+    # children are dropped as soon as each one closes, so the body of a large
+    # add-template is never held in memory; delete keying lives on the Item
+    # element itself (id attribute).
+    root = None
+    item_el = None
+    item_done = False
+    depth = 0  # nesting depth below the first <Item> while it is open
+    for event, elem in ET.iterparse(str(add_template), events=("start", "end")):
+        if root is None:
+            root = elem
+        if item_el is None:
+            # Descendants only, like root.find(".//Item"): a root-level <Item> is never the target
+            if event == "start" and elem.tag == "Item" and elem is not root:
+                item_el = elem
+            continue
+        if item_done:
+            continue
+        if event == "start":
+            depth += 1
+        elif elem is item_el:
+            del item_el[:]  # lxml keeps comments, which raise no start/end events
+            item_done = True
+        else:
+            depth -= 1
+            if depth == 0:
+                # Direct child fully parsed and always the only child left; a slice
+                # delete drops it without remove()'s linear search
+                del item_el[:]
 
-    # First AML Item node
-    item_el = root.find(".//Item")
     if item_el is None:
         raise RuntimeError(f"Could not find <Item> in template: {add_template}")
 
     # Always perform delete by ID on the Item element itself
     item_el.set("action", "delete")
-    # Remove all children; delete keying lives on the Item element (id attribute)
-    for child in list(item_el):
-        item_el.remove(child)
-
-    # Decide header presence strictly from config:
-    #   first_row > 1  ⇒ a header row exists in the data file
-    #   first_row <= 1 ⇒ headerless data (we do not inspect the file)
-    header_expected = (first_row or 1) > 1
-    if not header_expected:
-        # Headerless mode: GUID must be in column 1 for all types (base/relationship)
-        item_el.set("id", "@1")
-        if data_file:
-            print(f"[WARN] No headers expected (<first_row>={first_row or 1}); "
-                  f"assuming column 1 is the GUID in {data_file.name}")
-        out_path = dest_dir / add_template.name
-        _write_xml_pretty(root, out_path, indent_char="\t")
-        return out_path
-
-    # Headers are expected in this branch. We need to read them to locate the GUID column
-    if not data_file:
-        raise RuntimeError(
-            "Delete-template generation expects a data file when <first_row> indicates "
-            "a header row (> 1) so the GUID column can be discovered via the 'id' header."
-        )
-    headers = _read_headers_for(data_file, delimiter)
-    if not headers:
-        raise RuntimeError(
-            f"Could not read header row from '{data_file.name}'. "
-            "Verify <first_row> in your CLI config and the file encoding."
-        )
-    id_idx = _find_id_col(headers)
-    if id_idx is None:
-        raise RuntimeError(
-            f"'{data_file.name}' must include an 'id' column containing the GUID for the item/relationship to delete."
-        )
+    item_el.set("id", id_expr)
 
-    item_el.set("id", f"@{id_idx}")
-
-    out_path = dest_dir / add_template.name
     _write_xml_pretty(root, out_path, indent_char="\t") # Write the new delete template to the destination directory
+    try:
+        stamp_path.write_text(stamp, encoding="utf-8")
+    except OSError:
+        pass  # The template is fine; without a stamp the next run just rebuilds it
     return out_path